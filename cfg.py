@@ -1,14 +1,56 @@
+import os
 import pygame
+from charge_store import ChargeStore
 
 # Размеры окна
 WIDTH, HEIGHT = 1500, 800
-charges = []
+charges = ChargeStore()  # Заряды (x, y, q), общие для всех режимов
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 
 # Параметры по умолчанию
 STEP = 5
 ITERATIONS = 1000
 START_POINTS = 35
+FPS = 60  # Ограничение частоты кадров во время анимации
+CHARGE_RADIUS = 15  # Радиус отрисовки заряда в пикселях
+CHARGES_TOP = 130  # Выше этой строки полоса кнопок: заряды туда не ставятся и не заходят
+
+# Построение полного слоя по кадрам
+STEP_WORK = 300_000  # Объем работы (узлы × заряды или пиксели × шаги) на один шаг построения
+
+# Равномерное размещение силовых линий (метод Jobard–Lefer)
+FIELD_LINE_SEEDING = "even"  # "even" - равномерные линии, "radial" - линии от каждого заряда
+LINE_SEPARATION = 20  # Минимальное расстояние между соседними линиями в пикселях
+LINE_TEST_RATIO = 0.5  # Доля LINE_SEPARATION, при которой растущая линия останавливается
+
+# Предпросмотр при перетаскивании зарядов
+PREVIEW_BUDGET_MS = 16  # Бюджет времени на построение одного кадра предпросмотра
+PREVIEW_SCALES = [2, 3, 4, 6, 8]  # Уровни огрубления предпросмотра, от точного к грубому
+MESH_MIN_CHARGES = 100  # С этого числа зарядов поле предпросмотра считается сверткой на сетке
+
+# Текстура поля (line integral convolution)
+LIC_LENGTH = 15  # Число шагов адвекции в каждую сторону от пикселя
+LIC_COLORING = "potential"  # Окраска текстуры: "potential", "magnitude" или "none"
+LIC_PREVIEW_SCALES = [4, 6, 8, 12, 16]  # Предпросмотр текстуры дороже линий, поэтому грубее
+
+# Движение свободных зарядов
+CHARGE_MASS = 1.0  # Масса заряда в условных единицах
+DYNAMICS_DT = 0.05  # Фиксированный шаг интегрирования (модельное время)
+DYNAMICS_SPEED = 40  # Модельного времени за секунду реального
+DYNAMICS_BUDGET_MS = 8  # Время на шаги интегрирования за кадр; остаток отбрасывается
+DYNAMICS_SOFTENING = 5  # Сглаживание сил на малых расстояниях, в пикселях
+DYNAMICS_DIRECT_LIMIT = 300  # До этого числа зарядов силы считаются точно матрицей N × N
+# Для больших N силы ближе масштаба разделения считаются по парам, дальше - на сетке
+# с шагом вдвое меньше масштаба; берется самый крупный, при котором у заряда
+# в ближней зоне в среднем не больше DYNAMICS_NEIGHBOURS соседей
+DYNAMICS_SPLITS = [20, 14, 10]
+DYNAMICS_NEIGHBOURS = 30
+DYNAMICS_REPORT_STEPS = 100  # Как часто (в шагах) пересчитывать дрейф энергии
+
+# Кэш траекторий режима фокусировки
+TRAJECTORY_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".trajectory_cache")
+TRAJECTORY_MEMORY_LIMIT = 64 * 1024 * 1024  # Предел кэша в памяти, байт
+TRAJECTORY_DISK_LIMIT = 256 * 1024 * 1024  # Предел кэша на диске, байт
 
 # Цвета
 WHITE = (255, 255, 255)
@@ -0,0 +1,106 @@
+import numpy as np
+
+CHARGE_DTYPE = np.dtype([('x', np.float64), ('y', np.float64), ('q', np.float64)])
+
+
+class ChargeStore:
+    """Хранилище зарядов на растущем структурированном массиве NumPy.
+
+    Снаружи ведет себя как список кортежей (x, y, q), а векторным расчетам
+    отдает представления x, y, q без копирования. Каждое изменение
+    увеличивает version и вызывает подписчиков.
+    """
+
+    def __init__(self, capacity=16):
+        self._data = np.zeros(capacity, dtype=CHARGE_DTYPE)
+        self._size = 0
+        self._tuples = []
+        self._tuples_version = 0
+        self._callbacks = []
+        self.version = 0
+
+    # Представления для векторных расчетов
+    @property
+    def array(self):
+        return self._data[:self._size]
+
+    @property
+    def x(self):
+        return self._data['x'][:self._size]
+
+    @property
+    def y(self):
+        return self._data['y'][:self._size]
+
+    @property
+    def q(self):
+        return self._data['q'][:self._size]
+
+    # Подписка на изменения
+    def subscribe(self, callback):
+        """Регистрирует callback(store), вызываемый после каждого изменения."""
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        self._callbacks.remove(callback)
+
+    def _changed(self):
+        self.version += 1
+        for callback in list(self._callbacks):
+            callback(self)
+
+    # Изменение
+    def _reserve(self, size):
+        if size > len(self._data):
+            grown = np.zeros(max(size, 2 * len(self._data)), dtype=CHARGE_DTYPE)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+
+    def append(self, charge):
+        self._reserve(self._size + 1)
+        self._data[self._size] = charge
+        self._size += 1
+        self._changed()
+
+    def extend(self, charges):
+        """Добавляет несколько зарядов с одним уведомлением."""
+        charges = list(charges)
+        self._reserve(self._size + len(charges))
+        for charge in charges:
+            self._data[self._size] = charge
+            self._size += 1
+        self._changed()
+
+    def clear(self):
+        self._size = 0
+        self._changed()
+
+    def set_positions(self, x, y):
+        """Переписывает координаты всех зарядов одним изменением."""
+        self.x[:] = x
+        self.y[:] = y
+        self._changed()
+
+    def __setitem__(self, index, charge):
+        self._data[range(self._size)[index]] = charge
+        self._changed()
+
+    # Доступ как к списку кортежей
+    def _as_tuples(self):
+        # Кортежи пересобираются только после изменений, чтобы поточечные циклы оставались быстрыми
+        if self._tuples_version != self.version:
+            self._tuples = [tuple(row) for row in self.array.tolist()]
+            self._tuples_version = self.version
+        return self._tuples
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self._as_tuples())
+
+    def __getitem__(self, index):
+        return self._as_tuples()[index]
+
+    def __bool__(self):
+        return self._size > 0
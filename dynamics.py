@@ -0,0 +1,342 @@
+import time
+from cfg import *
+from mesh import cic_weights, deposit, interpolate, mesh_convolve
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.special import exp1
+
+# Строк матрицы пар за один векторный шаг расчета энергии
+ENERGY_BLOCK_ROWS = 64
+# Радиус ближней зоны в масштабах разделения: дальше ближняя часть сил меньше exp(-8)
+SHORT_RANGE_CUTOFF = 4
+
+
+def direct_forces(pos, q, eps2):
+    """Попарные силы Кулона (2D, сглаженные) массивами N × N."""
+    d = pos[:, None, :] - pos[None, :, :]
+    r2 = (d ** 2).sum(axis=-1) + eps2
+    # q_i q_j d / r^2: одноименные заряды отталкиваются; диагональ дает d = 0
+    coeff = q[:, None] * q[None, :] / r2
+    return (coeff[..., None] * d).sum(axis=1)
+
+
+def potential_energy_steps(pos, q, eps2):
+    """Потенциальная энергия сглаженного 2D-взаимодействия, точно по всем парам.
+
+    Генератор: считает блоками строк по ENERGY_BLOCK_ROWS (у строки i берутся
+    только заряды j > i) и отдает управление после каждого блока; энергия -
+    значение генератора.
+    """
+    total = 0.0
+    for first in range(0, len(q) - 1, ENERGY_BLOCK_ROWS):
+        block = slice(first, first + ENERGY_BLOCK_ROWS)
+        r2 = ((pos[block, None, :] - pos[None, first:, :]) ** 2).sum(axis=-1) + eps2
+        total -= 0.5 * np.triu(q[block, None] * q[None, first:] * np.log(r2), 1).sum()
+        yield
+    return total
+
+
+# Приближенный расчет для больших N (particle-particle/particle-mesh).
+# Сила q_i q_j d / (r^2 + eps2) делится множителем exp(-r^2 / 2 s^2) на ближнюю
+# часть, которая считается точно по парам ближе SHORT_RANGE_CUTOFF * s, и
+# гладкую дальнюю, которая считается сверткой на сетке за время, не зависящее
+# от числа зарядов. Потенциал -log(r^2 + eps2) / 2 делится так же.
+
+# (eps2, split) -> узлы по r^2 и значения short_potential для short_potential_pairs
+_short_tables = {}
+
+
+def short_potential(r2, eps2, split):
+    """Ближняя часть потенциала: ее производная - ближняя часть силы."""
+    a = 2 * split ** 2
+    return 0.5 * np.exp(eps2 / a) * exp1((r2 + eps2) / a)
+
+
+def short_potential_pairs(r2, eps2, split):
+    """short_potential для расстояний в ближней зоне по таблице (exp1 дорог)."""
+    key = (eps2, split)
+    if key not in _short_tables:
+        nodes = np.linspace(0, (SHORT_RANGE_CUTOFF * split) ** 2, 4096)
+        _short_tables[key] = nodes, short_potential(nodes, eps2, split)
+    nodes, values = _short_tables[key]
+    # Узлы равномерные: номер узла считается сразу, без двоичного поиска np.interp
+    t = np.minimum(r2 / nodes[1], len(nodes) - 1.000001)
+    k = t.astype(np.int64)
+    t -= k
+    return values[k] * (1 - t) + values[k + 1] * t
+
+
+def long_kernels(eps2, split):
+    """Ядра дальней части поля по x, по y и потенциала для mesh_convolve."""
+    def damping(ox, oy):
+        return -np.expm1(-(ox ** 2 + oy ** 2) / (2 * split ** 2)) / (ox ** 2 + oy ** 2 + eps2)
+
+    def field_x(ox, oy):
+        return ox * damping(ox, oy)
+
+    def field_y(ox, oy):
+        return oy * damping(ox, oy)
+
+    def potential(ox, oy):
+        r2 = ox ** 2 + oy ** 2
+        return -0.5 * np.log(r2 + eps2) - short_potential(r2, eps2, split)
+
+    return field_x, field_y, potential
+
+
+def choose_split(n):
+    """Масштаб разделения для n зарядов из DYNAMICS_SPLITS.
+
+    С ростом n масштаб уменьшается, и число пар в ближней зоне растет
+    линейно, а не как n^2; сетка при этом мельчает.
+    """
+    area = WIDTH * (HEIGHT - CHARGES_TOP)
+    for split in DYNAMICS_SPLITS:
+        if n * np.pi * (SHORT_RANGE_CUTOFF * split) ** 2 / area <= DYNAMICS_NEIGHBOURS:
+            return split
+    return DYNAMICS_SPLITS[-1]
+
+
+def mesh_grid(split):
+    """Шаг и размер сетки дальней части сил: узлы с шагом split / 2 на все окно."""
+    cell = split // 2
+    return cell, -(-WIDTH // cell), -(-HEIGHT // cell)
+
+
+def short_pairs(pos, split):
+    """Пары зарядов (i < j) ближе SHORT_RANGE_CUTOFF * split."""
+    pairs = cKDTree(pos).query_pairs(SHORT_RANGE_CUTOFF * split, output_type='ndarray')
+    return pairs[:, 0], pairs[:, 1]
+
+
+def mesh_forces(pos, q, eps2, split):
+    """Приближенные силы: ближние пары точно, дальняя часть - сверткой на сетке."""
+    n = len(q)
+    x, y = pos[:, 0].copy(), pos[:, 1].copy()
+    i, j = short_pairs(pos, split)
+    # Покомпонентно: выборка строк pos[i] и сумма по короткой оси заметно медленнее
+    dx, dy = x[i] - x[j], y[i] - y[j]
+    r2 = dx * dx + dy * dy
+    coeff = q[i] * q[j] * np.exp(-r2 / (2 * split ** 2)) / (r2 + eps2)
+
+    cell, width, height = mesh_grid(split)
+    density = deposit(x, y, q, width, height, cell)
+    field_x, field_y, _ = long_kernels(eps2, split)
+    forces = np.empty((n, 2))
+    fields = mesh_convolve(density, cell, {("dynamics", "Ex", eps2, split): field_x,
+                                           ("dynamics", "Ey", eps2, split): field_y})
+    for axis, field, d in ((0, fields[0], dx), (1, fields[1], dy)):
+        # Свой вклад заряда в поле на сетке симметричен и силы не дает
+        forces[:, axis] = q * interpolate(field, x, y, cell)
+        f = coeff * d
+        forces[:, axis] += np.bincount(i, weights=f, minlength=n)
+        forces[:, axis] -= np.bincount(j, weights=f, minlength=n)
+    return forces
+
+
+def mesh_potential_energy_steps(pos, q, eps2, split):
+    """Потенциальная энергия с тем же разделением, что и mesh_forces.
+
+    Генератор, как potential_energy_steps: отдает управление после ближней
+    части и после свертки на сетке.
+    """
+    x, y = pos[:, 0].copy(), pos[:, 1].copy()
+    i, j = short_pairs(pos, split)
+    r2 = (x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2
+    total = (q[i] * q[j] * short_potential_pairs(r2, eps2, split)).sum()
+    yield
+
+    cell, width, height = mesh_grid(split)
+    _, _, kernel = long_kernels(eps2, split)
+    density = deposit(x, y, q, width, height, cell)
+    potential, = mesh_convolve(density, cell, {("dynamics", "potential", eps2, split): kernel})
+    total += 0.5 * (q * interpolate(potential, x, y, cell)).sum()
+    yield
+
+    # Вычитаем энергию заряда в собственном потенциале: на сетке он размазан
+    # по четырем узлам, и между ними смещения не больше одной ячейки
+    corners = [(0, 0), (0, 1), (1, 0), (1, 1)]
+    weights = [weight for _, weight in cic_weights(x, y, width, height, cell)]
+    self_energy = 0.0
+    for (ia, ja), wa in zip(corners, weights):
+        for (ib, jb), wb in zip(corners, weights):
+            offset = kernel(np.float64((ia - ib) * cell), np.float64((ja - jb) * cell))
+            self_energy = self_energy + wa * wb * offset
+    total -= 0.5 * (q ** 2 * self_energy).sum()
+    return total
+
+
+class ChargeDynamics:
+    """Движение свободных зарядов под действием взаимных сил Кулона.
+
+    Интегрирование - метод leapfrog (kick-drift-kick) с фиксированным шагом
+    DYNAMICS_DT, число шагов в секунду не зависит от частоты кадров. На
+    работу в одном кадре отводится DYNAMICS_BUDGET_MS: шаг делается, только
+    если он по прошлому замеру укладывается в остаток бюджета, а дрейф
+    энергии считается по частям в нескольких кадрах. Если шагов не хватает,
+    модель замедляется, а не тормозит отрисовку; если не помещается и один
+    шаг, заряды стоят.
+    Позиции пишутся обратно в хранилище зарядов одним изменением за кадр.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.velocities = np.zeros((0, 2))
+        self.accumulator = 0.0
+        self.steps = 0
+        self.initial_energy = None
+        self.drift = 0.0
+        self._report_due = False  # Пора пересчитать дрейф энергии
+        self._energy_job = None  # Генератор energy_steps, который считается по кадрам
+        self._costs = {}  # Вид работы ("step", "energy") -> длительность прошлого раза на заряд, с
+        self._warm = set()  # (вид работы, масштаб разделения), для которых кэши ядер уже построены
+        # Ускорения после последнего шага и версия хранилища, для которой они верны
+        self._acc = None
+        self._acc_version = None
+        self._writing = False
+        self._on_store_changed(store)
+        store.subscribe(self._on_store_changed)
+
+    def _on_store_changed(self, store):
+        if self._writing:
+            return
+        # Заряды добавлены, удалены или сдвинуты мышью: новые стоят на месте,
+        # а энергия отсчитывается заново
+        n = len(store)
+        velocities = np.zeros((n, 2))
+        keep = min(n, len(self.velocities))
+        velocities[:keep] = self.velocities[:keep]
+        self.velocities = velocities
+        self.initial_energy = None
+        self.drift = 0.0
+        self._report_due = False
+        self._energy_job = None
+
+    def stop_charge(self, index):
+        """Останавливает заряд index, например отпущенный после перетаскивания."""
+        self.velocities[index] = 0
+
+    def forces(self, pos, q):
+        eps2 = DYNAMICS_SOFTENING ** 2
+        if len(q) <= DYNAMICS_DIRECT_LIMIT:
+            return direct_forces(pos, q, eps2)
+        return mesh_forces(pos, q, eps2, choose_split(len(q)))
+
+    def energy_steps(self, pos, q, velocities):
+        """Полная энергия по частям (генератор, как potential_energy_steps).
+
+        Потенциальная энергия считается с тем же приближением, что и силы,
+        иначе для больших N дрейф показывал бы ошибку самого приближения.
+        """
+        kinetic = 0.5 * CHARGE_MASS * (velocities ** 2).sum()
+        eps2 = DYNAMICS_SOFTENING ** 2
+        if len(q) <= DYNAMICS_DIRECT_LIMIT:
+            potential = yield from potential_energy_steps(pos, q, eps2)
+        else:
+            potential = yield from mesh_potential_energy_steps(pos, q, eps2, choose_split(len(q)))
+        return kinetic + potential
+
+    def _fits(self, kind, deadline):
+        """Проверяет, что работа kind по прошлому замеру успеет до deadline.
+
+        Замер хранится в расчете на заряд, поэтому оценка остается
+        пригодной, когда заряды добавляют или удаляют.
+        """
+        cost = self._costs.get(kind, 0.0) * len(self.store)
+        if time.perf_counter() + cost <= deadline:
+            return True
+        if cost > DYNAMICS_BUDGET_MS / 1000:
+            # Оценка больше всего бюджета, и эта работа больше не замеряется:
+            # она понемногу снижается, чтобы один случайно долгий замер не
+            # остановил модель насовсем
+            self._costs[kind] *= 0.98
+        return False
+
+    def _measure(self, kind, start):
+        # Первый раз при новом масштабе разделения строятся ядра свертки, и
+        # такой замер завысил бы оценку навсегда: шаги бы больше не делались
+        n = len(self.store)
+        key = kind, n > DYNAMICS_DIRECT_LIMIT and choose_split(n)
+        if key in self._warm:
+            self._costs[kind] = (time.perf_counter() - start) / n
+        self._warm.add(key)
+
+    def _energy_part(self):
+        """Продвигает расчет энергии на одну часть; по готовности обновляет дрейф."""
+        start = time.perf_counter()
+        try:
+            next(self._energy_job)
+        except StopIteration as done:
+            self._energy_job = None
+            if self.initial_energy is None:
+                self.initial_energy = done.value
+            else:
+                self.drift = (done.value - self.initial_energy) / max(abs(self.initial_energy), 1e-12)
+        self._measure("energy", start)
+
+    def advance(self, elapsed):
+        """Продвигает систему на elapsed секунд реального времени."""
+        if len(self.store) < 2:
+            return
+        deadline = time.perf_counter() + DYNAMICS_BUDGET_MS / 1000
+        pos = np.stack([self.store.x, self.store.y], axis=1)
+        q = self.store.q.copy()
+
+        # Энергия считается по снимку состояния, по одной части за кадр
+        if self._energy_job is None and (self.initial_energy is None or self._report_due):
+            self._report_due = False
+            self._energy_job = self.energy_steps(pos.copy(), q, self.velocities.copy())
+        if self._energy_job is not None and self._fits("energy", deadline):
+            self._energy_part()
+
+        self.accumulator += elapsed * DYNAMICS_SPEED
+
+        dt = DYNAMICS_DT
+        v = self.velocities
+        if self.accumulator < dt:
+            return
+        if self._acc_version != self.store.version:
+            # Ускорения после перемещения зарядов мышью стоят как шаг
+            if not self._fits("step", deadline):
+                self.accumulator = 0.0
+                return
+            start = time.perf_counter()
+            self._acc = self.forces(pos, q) / CHARGE_MASS
+            self._acc_version = self.store.version
+            self._measure("step", start)
+        acc = self._acc
+        moved = False
+        while self.accumulator >= dt:
+            # Шаг, который не успеет до конца бюджета, не делаем; остаток не
+            # копим, и модель просто отстает от реального времени
+            if not self._fits("step", deadline):
+                self.accumulator = 0.0
+                break
+            start = time.perf_counter()
+            v += 0.5 * dt * acc
+            pos += dt * v
+            # Упругое отражение от краев окна и от полосы кнопок сверху
+            for axis, floor, limit in ((0, 0, WIDTH), (1, CHARGES_TOP, HEIGHT)):
+                low = pos[:, axis] < floor
+                high = pos[:, axis] > limit
+                pos[low, axis] = 2 * floor - pos[low, axis]
+                pos[high, axis] = 2 * limit - pos[high, axis]
+                v[low | high, axis] = -v[low | high, axis]
+            acc = self.forces(pos, q) / CHARGE_MASS
+            v += 0.5 * dt * acc
+            self.accumulator -= dt
+            self.steps += 1
+            if self.steps % DYNAMICS_REPORT_STEPS == 0:
+                self._report_due = True
+            self._measure("step", start)
+            moved = True
+        if not moved:
+            return
+
+        self._writing = True
+        try:
+            self.store.set_positions(pos[:, 0], pos[:, 1])
+        finally:
+            self._writing = False
+        self._acc = acc
+        self._acc_version = self.store.version
@@ -1,17 +1,45 @@
 from cfg import *
-from power_lines import compute_field
+from power_lines import compute_field, coarse_field_grid, trace_grid_lines, trace_deadline, draw_grid_lines
 import numpy as np
 
 
-def draw_equipotential_lines(surface):
-    """Рисует эквипотенциальные линии на указанной поверхности."""
+def draw_equipotential_preview(surface, scale, deadline=None):
+    """Быстрый предпросмотр эквипотенциальных линий при перетаскивании зарядов.
+
+    Те же затравки, что и в equipotential_steps, но все линии идут
+    одновременно по полю, посчитанному на грубой сетке.
+    """
+    if not charges:
+        return
+    cell_size = STEP * scale
+    Ex, Ey = coarse_field_grid(cell_size)
+    angles = np.linspace(0, 2 * np.pi, START_POINTS)[14::15]
+    seeds = np.stack([
+        (charges.x[:, None] + 20 * np.cos(angles)).ravel(),
+        (charges.y[:, None] + 20 * np.sin(angles)).ravel(),
+    ], axis=1)
+    directions = np.ones(len(seeds))
+    # Эквипотенциали перпендикулярны полю
+    points, counts = trace_grid_lines(seeds, directions, -Ey, Ex, cell_size, cell_size,
+                                      ITERATIONS // scale, deadline=trace_deadline(deadline))
+    draw_grid_lines(surface, points, counts, deadline)
+
+
+def equipotential_steps(surface):
+    """Рисует эквипотенциальные линии на указанной поверхности по шагам:
+    генератор отдает управление после каждого шага трассировки."""
     for cx, cy, q in charges:
         i = 0
         for angle in np.linspace(0, 2 * np.pi, START_POINTS):
+            i += 1
+            # Рисуется только каждая 15-я линия, остальные не трассируем
+            if i % 15 != 0:
+                continue
             x, y = cx + 20 * np.cos(angle), cy + 20 * np.sin(angle)
             points = []
 
             for _ in range(ITERATIONS):
+                yield
                 Ex, Ey = compute_field(x, y)
                 norm = np.hypot(Ex, Ey)
                 if norm < 1e-3:
@@ -22,9 +50,8 @@ def draw_equipotential_lines(surface):
                 y += STEP * Ey
 
                 points.append((x, y))
-            i += 1
 
-            if len(points) > 1 and i % 15 == 0:
+            if len(points) > 1:
                 pygame.draw.lines(surface, BLACK, False, points, 1)
 
 
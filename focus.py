@@ -3,6 +3,8 @@ import numpy as np
 import pygame
 import math
 from scipy.integrate import odeint
+from fonts import render_text
+from trajectory_cache import TrajectoryCache, trajectory_key
 
 # Глобальные константы
 ELECTRON_RADIUS = 8  # радиус электрона в пикселях
@@ -66,6 +68,11 @@ electron_colors = [
 # Глобальные переменные для хранения траекторий и времени последнего обновления
 trajectories_data = None
 last_update_time = 0
+# Траектории в экранных координатах, пересчитываются только при новой симуляции
+screen_trajectories = None
+screen_trajectories_source = None
+# Результаты симуляций по хэшу конфигурации: в памяти и сжатыми на диске
+trajectory_cache = TrajectoryCache(TRAJECTORY_CACHE_DIR, TRAJECTORY_MEMORY_LIMIT, TRAJECTORY_DISK_LIMIT)
 
 
 def CEL1(t):
@@ -142,12 +149,20 @@ def electron_motion(y, t, q_rings, R_rings):
 
 
 
-def simulate_electrons_trajectories(rings, electrons):
-    """Моделирование траекторий электронов через систему колец"""
+def simulate_electrons_trajectories(rings, electrons, t_max=3e-8, n_steps=5000):
+    """Моделирование траекторий электронов через систему колец
+
+    t_max - время симуляции [с], n_steps - количество шагов. Уже считанные
+    конфигурации берутся из trajectory_cache без пересчета.
+    """
     global trajectories_data
 
-    t_max = 3e-8  # время симуляции [с]
-    n_steps = 5000  # Количество шагов
+    key = trajectory_key(rings, electrons, t_max, n_steps)
+    cached = trajectory_cache.get(key)
+    if cached is not None:
+        trajectories_data = cached
+        return
+
     t = np.linspace(0, t_max, n_steps)
 
     R_rings = [ring['radius'] for ring in rings]
@@ -182,6 +197,24 @@ def simulate_electrons_trajectories(rings, electrons):
         trajectories.append(trajectory[:forward_indices[-1] + 1] if forward_indices else trajectory)
 
     trajectories_data = (t, trajectories)
+    trajectory_cache.put(key, trajectories_data)
+
+
+def trajectories_to_screen(trajectories, offset_x, offset_y, scale_x, scale_y):
+    """Конвертирует траектории в экранные координаты (с кэшированием)"""
+    global screen_trajectories, screen_trajectories_source
+
+    if screen_trajectories_source is trajectories:
+        return screen_trajectories
+
+    screen_trajectories = []
+    for trajectory in trajectories:
+        x_px = offset_x + trajectory[:, 1] * scale_x
+        y_px = offset_y + trajectory[:, 0] * scale_y
+        visible = (-50 < x_px) & (x_px < WIDTH + 50) & (-50 < y_px) & (y_px < HEIGHT + 50)
+        screen_trajectories.append(list(zip(x_px[visible].tolist(), y_px[visible].tolist())))
+    screen_trajectories_source = trajectories
+    return screen_trajectories
 
 
 def draw_focus_lines(surface):
@@ -223,9 +256,8 @@ def draw_focus_lines(surface):
 
             # Подписи зарядов
             if x_pos > 30 and x_pos < WIDTH - 30:
-                font = pygame.font.SysFont("Arial", 10)
                 charge_text = f"{abs(ring['charge']):.0e}C"
-                text_surface = font.render(charge_text, True, BLACK)
+                text_surface = render_text(charge_text, 10, BLACK)
                 surface.blit(text_surface, (x_pos - 15, offset_y + line_length + 5))
 
     # Анимация движения электронов
@@ -237,17 +269,10 @@ def draw_focus_lines(surface):
         last_update_time = current_time
         progress = 0.0
 
-    for i, trajectory in enumerate(trajectories):
-        color = electron_colors[i % len(electron_colors)]
+    screen_points_list = trajectories_to_screen(trajectories, offset_x, offset_y, scale_x, scale_y)
 
-        # Конвертируем все точки траектории в экранные координаты
-        screen_points = []
-        for point in trajectory:
-            ro, z = point
-            x_px = offset_x + z * scale_x
-            y_px = offset_y + ro * scale_y
-            if -50 < x_px < WIDTH + 50 and -50 < y_px < HEIGHT + 50:
-                screen_points.append((x_px, y_px))
+    for i, screen_points in enumerate(screen_points_list):
+        color = electron_colors[i % len(electron_colors)]
 
         # Рисуем траекторию
         if len(screen_points) > 1:
@@ -285,14 +310,13 @@ def draw_focus_lines(surface):
             pygame.draw.circle(surface, BLACK, (x_px, y_px), 2)
 
     # Подписи осей
-    font = pygame.font.SysFont("Arial", 12)
     # Ось Z (горизонтальная)
     pygame.draw.line(surface, BLACK, (20, HEIGHT - 20), (WIDTH - 20, HEIGHT - 20), 1)
     pygame.draw.polygon(surface, BLACK,
                         [(WIDTH - 25, HEIGHT - 25), (WIDTH - 20, HEIGHT - 20), (WIDTH - 25, HEIGHT - 15)])
-    surface.blit(font.render("z", True, BLACK), (WIDTH - 15, HEIGHT - 25))
+    surface.blit(render_text("z", 12, BLACK), (WIDTH - 15, HEIGHT - 25))
 
     # Ось ro (вертикальная)
     pygame.draw.line(surface, BLACK, (20, HEIGHT - 20), (20, 20), 2)
     pygame.draw.polygon(surface, BLACK, [(15, 25), (20, 20), (25, 25)])
-    surface.blit(font.render("ro", True, BLACK), (25, 15))
\ No newline at end of file
+    surface.blit(render_text("ro", 12, BLACK), (25, 15))
\ No newline at end of file
@@ -0,0 +1,25 @@
+import pygame
+
+# Кэш шрифтов и отрендеренных надписей
+_fonts = {}
+_texts = {}
+
+
+def get_font(size, name="Arial"):
+    """Возвращает шрифт из кэша, создавая его только при первом обращении."""
+    key = (name, size)
+    font = _fonts.get(key)
+    if font is None:
+        font = pygame.font.SysFont(name, size)
+        _fonts[key] = font
+    return font
+
+
+def render_text(text, size, color, name="Arial"):
+    """Возвращает поверхность с надписью, отрендеренной один раз."""
+    key = (text, size, color, name)
+    surface = _texts.get(key)
+    if surface is None:
+        surface = get_font(size, name).render(text, True, color)
+        _texts[key] = surface
+    return surface
@@ -0,0 +1,177 @@
+import time
+from cfg import *
+from power_lines import compute_field_grid, cell_field_grid
+from potential_map import compute_potential_grid, cell_potential_grid
+import numpy as np
+
+# Белый шум, общий для всех построений, чтобы текстура не "кипела" при перестройке
+_noise = {}
+
+
+def get_noise(width, height):
+    """Возвращает белый шум нужного размера (кэшируется)."""
+    key = (width, height)
+    if key not in _noise:
+        _noise[key] = np.random.default_rng(0).random((height, width), dtype=np.float32)
+    return _noise[key]
+
+
+def field_directions(Ex, Ey):
+    """Единичные векторы поля, развернутые в плоские массивы."""
+    norm = np.hypot(Ex, Ey)
+    norm[norm == 0] = 1
+    return (Ex / norm).ravel(), (Ey / norm).ravel()
+
+
+def convolve_rows(ux, uy, noise, length, rows, deadline=None):
+    """Свертка шума вдоль линий поля для пикселей строк rows (срез).
+
+    Линии тока всех пикселей полосы продвигаются одновременно, по шагу в 1
+    пиксель за итерацию, в обе стороны от стартовой точки, и могут уходить
+    за пределы полосы. После deadline новые шаги не делаются - штрихи
+    текстуры просто получаются короче.
+    """
+    height, width = noise.shape
+    flat_noise = noise.ravel()
+    first, last = rows.start, min(rows.stop, height)
+
+    ys, xs = np.mgrid[first:last, 0:width].astype(np.float32)
+    start_x = xs.ravel() + 0.5
+    start_y = ys.ravel() + 0.5
+    start_index = np.arange(first * width, last * width)
+
+    total = flat_noise[start_index]
+    count = np.ones_like(total)
+    for direction in (1, -1):
+        px = start_x.copy()
+        py = start_y.copy()
+        alive = np.ones(total.shape, dtype=bool)
+        index = start_index
+        for _ in range(length):
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            px += direction * ux[index]
+            py += direction * uy[index]
+            # Линия, вышедшая за окно, дальше не накапливается
+            alive &= (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            index = np.where(alive, py.astype(np.int32) * width + px.astype(np.int32), index)
+            total += np.where(alive, flat_noise[index], 0)
+            count += alive
+    return (total / count).reshape(last - first, width)
+
+
+def coloring_value(Ex, Ey, potential):
+    """Величина, по которой окрашивается текстура, или None, если окраски нет."""
+    if LIC_COLORING == "magnitude":
+        return np.log1p(np.hypot(Ex, Ey) * 1000)
+    if LIC_COLORING == "potential":
+        return potential
+    return None
+
+
+def scale_bounds(values, percentiles):
+    """Границы шкалы по перцентилям; прореженной сетки для этого достаточно."""
+    if values is None:
+        return None
+    return np.percentile(values[::4, ::4], percentiles)
+
+
+def coloring_bounds(value):
+    """Границы шкалы окраски. Шкала потенциала симметрична, чтобы белый цвет означал ноль."""
+    bounds = scale_bounds(value, [2, 98])
+    if bounds is not None and LIC_COLORING == "potential":
+        limit = np.abs(bounds).max()
+        bounds = np.array([-limit, limit])
+    return bounds
+
+
+def lic_image(texture, value, texture_bounds, value_bounds):
+    """Поверхность с окрашенной текстурой (или ее полосой) по LIC_COLORING."""
+    # Растягиваем контраст: после усреднения шум сжимается к 0.5
+    low, high = texture_bounds
+    texture = np.clip((texture - low) / max(high - low, 1e-9), 0, 1)
+
+    colors = np.ones(texture.shape + (3,), dtype=np.float32)
+    if value is not None:
+        low, high = value_bounds
+        t = np.clip((value - low) / max(high - low, 1e-9), 0, 1)
+        if LIC_COLORING == "magnitude":
+            colors[..., 0] = t
+            colors[..., 1] = 0.3
+            colors[..., 2] = 1 - t
+        else:
+            # Сине-бело-красная шкала: отрицательный потенциал синий, положительный красный
+            colors[..., 0] = np.minimum(1, 2 * t)
+            colors[..., 1] = 1 - np.abs(2 * t - 1)
+            colors[..., 2] = np.minimum(1, 2 - 2 * t)
+
+    rgb = colors * (0.2 + 0.8 * texture[..., None])
+    return pygame.surfarray.make_surface((rgb * 255).astype(np.uint8).transpose(1, 0, 2))
+
+
+def draw_lic_preview(surface, scale, deadline=None):
+    """Быстрый предпросмотр текстуры поля на всю поверхность за один вызов.
+
+    Текстура строится в разрешении, уменьшенном в scale раз. При многих
+    зарядах поле и потенциал считаются сверткой на сетке, и время
+    построения почти не зависит от их числа.
+    """
+    width, height = WIDTH // scale, HEIGHT // scale
+    Ex, Ey = cell_field_grid(width, height, scale)
+    potential = cell_potential_grid(width, height, scale) if LIC_COLORING == "potential" else None
+
+    ux, uy = field_directions(Ex, Ey)
+    noise = get_noise(width, height)
+    texture = convolve_rows(ux, uy, noise, max(LIC_LENGTH // scale, 2), slice(0, height), deadline)
+    value = coloring_value(Ex, Ey, potential)
+    image = lic_image(texture, value, scale_bounds(texture, [1, 99]), coloring_bounds(value))
+    surface.blit(pygame.transform.smoothscale(image, (WIDTH, HEIGHT)), (0, 0))
+
+
+def bands(height, rows):
+    """Делит строки 0..height на полосы по rows строк."""
+    return [slice(first, min(first + rows, height)) for first in range(0, height, rows)]
+
+
+def lic_steps(surface):
+    """Полное построение текстуры по шагам, для построения в промежутках между кадрами.
+
+    Генератор: поле, потенциал, свертка и окраска считаются полосами строк,
+    и после каждой полосы управление возвращается вызывающему. Шаг занимает
+    порядка STEP_WORK элементарных операций.
+    """
+    xs = np.arange(WIDTH) + 0.5
+    ys = np.arange(HEIGHT) + 0.5
+    Ex = np.empty((HEIGHT, WIDTH), dtype=np.float32)
+    Ey = np.empty_like(Ex)
+    ux = np.empty(HEIGHT * WIDTH, dtype=np.float32)
+    uy = np.empty_like(ux)
+    # Поле и потенциал стоят пропорционально числу зарядов
+    field_rows = max(1, STEP_WORK // (WIDTH * max(len(charges), 1)))
+    for rows in bands(HEIGHT, field_rows):
+        Ex[rows], Ey[rows] = compute_field_grid(xs, ys[rows])
+        flat = slice(rows.start * WIDTH, rows.stop * WIDTH)
+        ux[flat], uy[flat] = field_directions(Ex[rows], Ey[rows])
+        yield
+    potential = None
+    if LIC_COLORING == "potential":
+        potential = np.empty_like(Ex)
+        for rows in bands(HEIGHT, field_rows):
+            potential[rows] = compute_potential_grid(xs, ys[rows])
+            yield
+
+    noise = get_noise(WIDTH, HEIGHT)
+    texture = np.empty_like(Ex)
+    # Свертка стоит пропорционально числу шагов вдоль линии
+    for rows in bands(HEIGHT, max(1, STEP_WORK // (WIDTH * 2 * LIC_LENGTH))):
+        texture[rows] = convolve_rows(ux, uy, noise, LIC_LENGTH, rows)
+        yield
+
+    value = coloring_value(Ex, Ey, potential)
+    texture_bounds = scale_bounds(texture, [1, 99])
+    value_bounds = coloring_bounds(value)
+    yield
+    for rows in bands(HEIGHT, max(1, STEP_WORK // (WIDTH * 10))):
+        band_value = value[rows] if value is not None else None
+        surface.blit(lic_image(texture[rows], band_value, texture_bounds, value_bounds), (0, rows.start))
+        yield
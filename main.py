@@ -1,3 +1,4 @@
+import time
 import pygame
 import numpy as np
 from cfg import *
@@ -5,6 +6,9 @@ from power_lines import *
 from equipotential import *
 from focus import *
 from potential_map import *
+from lic import draw_lic_preview, lic_steps
+from dynamics import ChargeDynamics
+from fonts import get_font, render_text
 
 # Инициализация Pygame
 pygame.init()
@@ -16,7 +20,9 @@ mode = "field"  # Режим отображения: "field" - силовые л
 dropdown_rect = pygame.Rect(WIDTH - 150, 10, 140, 30)
 button_build_rect = pygame.Rect(WIDTH - 150, 50, 140, 30)
 button_reset_rect = pygame.Rect(WIDTH - 150, 90, 140, 30)  # Новая кнопка сброса
-dropdown_options = ["Силовые линии", "Эквипотенциальные", "Фокусировка", "Карта потенциала"]
+button_dynamics_rect = pygame.Rect(WIDTH - 300, 10, 140, 30)  # Левее меню, выше CHARGES_TOP
+status_rect = pygame.Rect(10, 10, 400, 30)  # Строка с дрейфом энергии
+dropdown_options = ["Силовые линии", "Эквипотенциальные", "Фокусировка", "Карта потенциала", "Текстура поля"]
 dropdown_active = False
 selected_option = 0
 
@@ -25,49 +31,360 @@ field_lines_surface = None
 equipotential_lines_surface = None
 focus_lines_surface = None
 potential_map_surface = None
+lic_surface = None
+
+# Статический слой сцены: фон, построенные линии и заряды
+scene_surface = pygame.Surface((WIDTH, HEIGHT))
+# Области экрана, которые нужно обновить в следующем кадре
+dirty_rects = []
+clock = pygame.time.Clock()
+
+# Перетаскивание зарядов
+dragged_charge = None  # Индекс перетаскиваемого заряда в charges
+# Режим -> индекс в его шкале огрубления; подстраивается под бюджет кадра,
+# начиная с самого грубого уровня, чтобы первый кадр не выходил за бюджет
+preview_levels = {}
+compose_time = 0.0  # Длительность последней сборки сцены в предпросмотре, с
+
+# Движение зарядов под действием взаимных сил
+dynamics = ChargeDynamics(charges)
+dynamics_running = False
+frame_time = 0.0  # Длительность последнего кадра в секундах
+
+# Режим -> (charges.version, scale), по которым построен его слой
+layer_versions = {}
+# Заряды изменились, статический слой сцены нужно собрать заново
+scene_stale = False
+# Полное построение слоя, растянутое на несколько кадров: генератор шагов,
+# поверхность, на которой оно идет, и (режим, charges.version), для которых
+refine_steps = None
+refine_surface = None
+refine_target = None
+
+
+def on_charges_changed(store):
+    """Помечает сцену устаревшей при любом изменении зарядов."""
+    global scene_stale
+    scene_stale = True
+
+
+charges.subscribe(on_charges_changed)
+
+
+def options_rect():
+    """Возвращает область, занимаемую раскрытым выпадающим меню."""
+    return pygame.Rect(WIDTH - 150, 40, 140, len(dropdown_options) * 30)
+
+
+def ui_rect():
+    """Возвращает область экрана, занятую кнопками."""
+    rect = dropdown_rect.union(button_build_rect).union(button_reset_rect).union(button_dynamics_rect)
+    if dropdown_active:
+        rect = rect.union(options_rect())
+    return rect
 
 
 def draw_buttons():
     """Рисует кнопки на экране."""
     # Рисуем выпадающее меню
     pygame.draw.rect(screen, GREEN, dropdown_rect, border_radius=5)
-    font = pygame.font.SysFont("Arial", 24)
-    text_dropdown = font.render(dropdown_options[selected_option], True, WHITE)
+    text_dropdown = render_text(dropdown_options[selected_option], 24, WHITE)
     screen.blit(text_dropdown, (dropdown_rect.x + 10, dropdown_rect.y + 5))
 
     # Рисуем кнопку "Построить"
     pygame.draw.rect(screen, BLUE, button_build_rect, border_radius=5)
-    text_build = font.render("Построить", True, WHITE)
+    text_build = render_text("Построить", 24, WHITE)
     screen.blit(text_build, (button_build_rect.x + 10, button_build_rect.y + 5))
 
     # Рисуем кнопку "Сброс" с красным фоном
     pygame.draw.rect(screen, RED, button_reset_rect, border_radius=5)
-    text_reset = font.render("Сброс", True, WHITE)
+    text_reset = render_text("Сброс", 24, WHITE)
     screen.blit(text_reset, (button_reset_rect.x + 40, button_reset_rect.y + 5))
 
+    # Кнопка запуска и остановки движения зарядов
+    pygame.draw.rect(screen, MAGENTA, button_dynamics_rect, border_radius=5)
+    text_dynamics = render_text("Стоп" if dynamics_running else "Движение", 24, WHITE)
+    screen.blit(text_dynamics, (button_dynamics_rect.x + 10, button_dynamics_rect.y + 5))
+
     # Рисуем стрелку вниз для выпадающего меню
     if dropdown_active:
         for i, option in enumerate(dropdown_options):
             option_rect = pygame.Rect(WIDTH - 150, 40 + i * 30, 140, 30)
             pygame.draw.rect(screen, GREEN, option_rect, border_radius=5)
-            text_option = font.render(option, True, WHITE)
+            text_option = render_text(option, 24, WHITE)
             screen.blit(text_option, (option_rect.x + 10, option_rect.y + 5))
 
 
-def build_field_lines():
-    """Строит силовые линии один раз и сохраняет на поверхности"""
+def draw_status():
+    """Выводит дрейф энергии во время движения зарядов."""
+    # Значение меняется каждый кадр, поэтому надпись не кэшируется
+    text = get_font(20).render(f"Шагов: {dynamics.steps}, дрейф энергии: {dynamics.drift:+.2e}", True, BLACK)
+    screen.blit(text, status_rect.topleft)
+
+
+def mark_dirty(rect=None):
+    """Помечает область экрана для перерисовки (по умолчанию весь экран)."""
+    dirty_rects.append(pygame.Rect(rect) if rect is not None else screen.get_rect())
+
+
+def active_layer():
+    """Возвращает построенную поверхность для текущего режима."""
+    if not draw_lines:
+        return None
+    if mode == "field":
+        return field_lines_surface
+    if mode == "equipotential":
+        return equipotential_lines_surface
+    if mode == "focus":
+        return focus_lines_surface
+    if mode == "potential_map":
+        return potential_map_surface
+    if mode == "lic":
+        return lic_surface
+    return None
+
+
+def compose_scene(full=True):
+    """Собирает статический слой сцены заново.
+
+    При full=False экран не помечается целиком - вызывающий сам отмечает
+    изменившиеся области.
+    """
+    global scene_stale
+    scene_stale = False
+    scene_surface.fill(WHITE)
+    layer = active_layer()
+    if layer:
+        scene_surface.blit(layer, (0, 0))
+    draw_charges(scene_surface)
+    if full:
+        mark_dirty()
+
+
+def add_charge(x, y, q):
+    """Добавляет заряд и помечает для перерисовки только его область."""
+    charges.append((x, y, q))
+    mark_dirty(charge_rect(len(charges) - 1))
+
+
+def charge_rect(index):
+    """Возвращает область экрана, занимаемую зарядом."""
+    x, y, q = charges[index]
+    return pygame.Rect(x - CHARGE_RADIUS, y - CHARGE_RADIUS, 2 * CHARGE_RADIUS + 1, 2 * CHARGE_RADIUS + 1)
+
+
+def charge_at(x, y):
+    """Возвращает индекс заряда под курсором или None."""
+    for i in reversed(range(len(charges))):
+        cx, cy, q = charges[i]
+        if (x - cx) ** 2 + (y - cy) ** 2 <= CHARGE_RADIUS ** 2:
+            return i
+    return None
+
+
+def move_charge(index, x, y):
+    """Переносит заряд в новую точку."""
+    mark_dirty(charge_rect(index))
+    cx, cy, q = charges[index]
+    charges[index] = (x, y, q)
+    mark_dirty(charge_rect(index))
+
+
+def has_live_layer():
+    """Проверяет, нужно ли пересчитывать построенный слой при движении зарядов."""
+    return draw_lines and mode != "focus"
+
+
+def dynamics_active():
+    """Проверяет, что заряды сейчас движутся сами (одному заряду двигаться не от чего)."""
+    return dynamics_running and mode != "focus" and dragged_charge is None and len(charges) >= 2
+
+
+def is_interactive():
+    """Проверяет, что заряды меняются прямо сейчас (перетаскивание или движение)."""
+    return dragged_charge is not None or dynamics_active()
+
+
+def layer_is_outdated():
+    """Проверяет, что построенный слой отстал от зарядов и нужен новый предпросмотр."""
+    if not has_live_layer() or active_layer() is None:
+        return False
+    built = layer_versions.get(mode)
+    return built is None or built[0] != charges.version
+
+
+def layer_is_stale():
+    """Проверяет, что построенный слой не соответствует текущим зарядам.
+
+    Пока заряды меняются, достаточно предпросмотра, после - нужен полный слой.
+    """
+    if not has_live_layer() or active_layer() is None:
+        return False
+    return layer_is_outdated() or (not is_interactive() and layer_versions[mode][1] != 1)
+
+
+def render_preview(frame_start):
+    """Строит огрубленный слой в пределах бюджета кадра и подстраивает огрубление.
+
+    Бюджет отсчитывается от начала кадра, так что время на шаги движения
+    зарядов вычитается из времени на предпросмотр. Сборка сцены (слой и
+    все заряды) тоже входит в бюджет: на нее оставляется время прошлой сборки.
+    """
+    global compose_time
+    scales = LIC_PREVIEW_SCALES if mode == "lic" else PREVIEW_SCALES
+    level = preview_levels.get(mode, len(scales) - 1)
+    start = time.perf_counter()
+    deadline = frame_start + PREVIEW_BUDGET_MS / 1000
+    budget = max(deadline - start, 0)
+    build_active_layer(scales[level], deadline - compose_time)
+    compose_start = time.perf_counter()
+    compose_scene()
+    compose_time = time.perf_counter() - compose_start
+    elapsed = time.perf_counter() - start
+
+    # Не уложились в бюджет - огрубляем, с большим запасом - уточняем
+    if elapsed > budget and level < len(scales) - 1:
+        level += 1
+    elif elapsed < budget / 3 and level > 0:
+        level -= 1
+    preview_levels[mode] = level
+
+
+def new_layer_surface():
+    """Создает пустую поверхность для слоя текущего режима."""
+    if mode in ("field", "equipotential"):
+        surface = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 0))
+    else:
+        surface = pygame.Surface((WIDTH, HEIGHT))
+        surface.fill(WHITE)
+    return surface
+
+
+def set_active_layer(surface):
+    """Подменяет построенную поверхность текущего режима."""
+    global field_lines_surface, equipotential_lines_surface, potential_map_surface, lic_surface
+    if mode == "field":
+        field_lines_surface = surface
+    elif mode == "equipotential":
+        equipotential_lines_surface = surface
+    elif mode == "potential_map":
+        potential_map_surface = surface
+    elif mode == "lic":
+        lic_surface = surface
+
+
+def layer_steps(surface):
+    """Шаги полного построения слоя текущего режима на поверхности surface."""
+    if mode == "field":
+        yield from field_lines_steps(surface)
+    elif mode == "equipotential":
+        yield from equipotential_steps(surface)
+    elif mode == "potential_map":
+        yield from potential_map_steps(surface)
+    elif mode == "lic":
+        yield from lic_steps(surface)
+
+
+def run_steps(steps, deadline):
+    """Выполняет шаги генератора до deadline. Возвращает True, если они кончились.
+
+    Первый шаг делается всегда, следующий - только если он, судя по
+    длительности предыдущего, успеет закончиться до deadline.
+    """
+    last = 0.0
+    while True:
+        start = time.perf_counter()
+        if start + last > deadline:
+            return False
+        try:
+            next(steps)
+        except StopIteration:
+            return True
+        last = time.perf_counter() - start
+
+
+def refine_layer(frame_start):
+    """Продолжает полное построение слоя в пределах бюджета кадра.
+
+    Пока оно идет, на экране остается предпросмотр; готовый слой подменяет
+    его целиком. Если заряды или режим сменились, построение начинается заново.
+    """
+    global refine_steps, refine_surface, refine_target
+    target = (mode, charges.version)
+    if refine_target != target:
+        refine_surface = new_layer_surface()
+        refine_steps = layer_steps(refine_surface)
+        refine_target = target
+    if not run_steps(refine_steps, frame_start + PREVIEW_BUDGET_MS / 1000):
+        return
+    set_active_layer(refine_surface)
+    layer_versions[mode] = (charges.version, 1)
+    refine_steps = refine_surface = refine_target = None
+    compose_scene()
+
+
+def is_animating():
+    """Проверяет, требует ли текущий режим перерисовки каждый кадр."""
+    if is_interactive() or layer_is_stale():
+        return True
+    return draw_lines and mode == "focus" and focus_lines_surface is not None
+
+
+def render_frame():
+    """Переносит изменившиеся области сцены на экран."""
+    frame_start = time.perf_counter()
+    if dynamics_active():
+        dynamics.advance(frame_time)
+        # Заряды разлетаются по всему окну
+        mark_dirty()
+
+    if layer_is_stale():
+        # Любое изменение зарядов (перетаскивание, движение, новый заряд) сначала
+        # дает предпросмотр в пределах бюджета кадра, а полный слой достраивается
+        # по кадрам, когда заряды перестают меняться
+        if layer_is_outdated():
+            render_preview(frame_start)
+        else:
+            refine_layer(frame_start)
+    elif draw_lines and mode == "focus" and focus_lines_surface is not None:
+        # Для режима фокусировки перерисовываем каждый кадр
+        draw_focus_lines(focus_lines_surface)
+        compose_scene()
+    elif scene_stale:
+        compose_scene(full=False)
+
+    if not dirty_rects:
+        return
+
+    rects = [rect.clip(screen.get_rect()) for rect in dirty_rects]
+    dirty_rects.clear()
+    for rect in rects:
+        screen.blit(scene_surface, rect, rect)
+    buttons = ui_rect()
+    if any(rect.colliderect(buttons) for rect in rects):
+        draw_buttons()
+    if dynamics_running and any(rect.colliderect(status_rect) for rect in rects):
+        draw_status()
+    pygame.display.update(rects)
+
+
+def build_field_lines(scale, deadline=None):
+    """Строит предпросмотр силовых линий и сохраняет на поверхности"""
     global field_lines_surface
-    field_lines_surface = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+    if field_lines_surface is None:
+        field_lines_surface = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
     field_lines_surface.fill((0, 0, 0, 0))
-    draw_field_lines(field_lines_surface)
+    draw_field_lines_preview(field_lines_surface, scale, deadline)
 
 
-def build_equipotential_lines():
-    """Строит эквипотенциальные линии один раз и сохраняет на поверхности"""
+def build_equipotential_lines(scale, deadline=None):
+    """Строит предпросмотр эквипотенциальных линий и сохраняет на поверхности"""
     global equipotential_lines_surface
-    equipotential_lines_surface = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+    if equipotential_lines_surface is None:
+        equipotential_lines_surface = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
     equipotential_lines_surface.fill((0, 0, 0, 0))
-    draw_equipotential_lines(equipotential_lines_surface)
+    draw_equipotential_preview(equipotential_lines_surface, scale, deadline)
 
 
 def build_focus_lines():
@@ -78,98 +395,155 @@ def build_focus_lines():
     draw_focus_lines(focus_lines_surface)
 
 
-def build_potential_map():
-    """Строит карту потенциала один раз и сохраняет на поверхности"""
+def build_potential_map(scale):
+    """Строит предпросмотр карты потенциала и сохраняет на поверхности"""
     global potential_map_surface
-    potential_map_surface = pygame.Surface((WIDTH, HEIGHT))
+    if potential_map_surface is None:
+        potential_map_surface = pygame.Surface((WIDTH, HEIGHT))
     potential_map_surface.fill(WHITE)
-    draw_potential_map(potential_map_surface)
+    draw_potential_map_preview(potential_map_surface, scale)
+
+
+def build_lic(scale, deadline=None):
+    """Строит предпросмотр текстуры направления поля и сохраняет на поверхности"""
+    global lic_surface
+    if lic_surface is None:
+        lic_surface = pygame.Surface((WIDTH, HEIGHT))
+    draw_lic_preview(lic_surface, scale, deadline)
+
+
+def build_active_layer(scale=1, deadline=None):
+    """Строит слой текущего режима.
+
+    Режим фокусировки строится сразу целиком. Для остальных строится
+    огрубленный предпросмотр с огрублением scale до deadline, а полный слой
+    достраивается по кадрам в refine_layer.
+    """
+    layer_versions[mode] = (charges.version, scale)
+    if mode == "field":
+        build_field_lines(scale, deadline)
+    elif mode == "equipotential":
+        build_equipotential_lines(scale, deadline)
+    elif mode == "focus":
+        build_focus_lines()
+    elif mode == "potential_map":
+        build_potential_map(scale)
+    elif mode == "lic":
+        build_lic(scale, deadline)
 
 
 def reset_simulation():
     """Полностью сбрасывает симуляцию"""
-    global draw_lines, field_lines_surface, equipotential_lines_surface, focus_lines_surface, potential_map_surface, charges
+    global draw_lines, field_lines_surface, equipotential_lines_surface, focus_lines_surface, potential_map_surface, lic_surface, charges
+    global dynamics_running, refine_steps, refine_surface, refine_target, dragged_charge
     draw_lines = False
+    dynamics_running = False
+    dragged_charge = None  # Перетаскиваемого заряда больше нет
     charges.clear()  # Очищаем список зарядов
     field_lines_surface = None
     equipotential_lines_surface = None
     focus_lines_surface = None
     potential_map_surface = None
+    lic_surface = None
+    layer_versions.clear()
+    refine_steps = refine_surface = refine_target = None
+    compose_scene()
+
+
+def handle_event(event):
+    """Обрабатывает одно событие. Возвращает False, если нужно выйти."""
+    global draw_lines, mode, dropdown_active, selected_option, charges, dragged_charge, dynamics_running
+    if event.type == pygame.QUIT:
+        return False
+    elif event.type == pygame.VIDEOEXPOSE:
+        mark_dirty()
+    elif event.type == pygame.MOUSEBUTTONDOWN and dragged_charge is None:
+        # Пока заряд перетаскивается, другие нажатия игнорируем
+        x, y = event.pos
+
+        # Обработка кликов на выпадающее меню
+        if dropdown_rect.collidepoint(x, y):
+            mark_dirty(ui_rect())
+            dropdown_active = not dropdown_active
+            mark_dirty(ui_rect())
+        elif dropdown_active:
+            mark_dirty(ui_rect())
+            for i, option in enumerate(dropdown_options):
+                option_rect = pygame.Rect(WIDTH - 150, 40 + i * 30, 140, 30)
+                if option_rect.collidepoint(x, y):
+                    selected_option = i
+                    dropdown_active = False
+                    if selected_option == 0:
+                        mode = "field"
+                    elif selected_option == 1:
+                        mode = "equipotential"
+                    elif selected_option == 2:
+                        mode = "focus"
+                    elif selected_option == 3:
+                        mode = "potential_map"
+                    elif selected_option == 4:
+                        mode = "lic"
+                    compose_scene()
+        # Обработка кликов на кнопку "Построить"
+        elif button_build_rect.collidepoint(x, y):
+            draw_lines = True
+            if not has_live_layer():
+                build_active_layer()
+            elif active_layer() is None or layer_is_stale():
+                # Как и после изменения зарядов: предпросмотр сразу, полный слой по кадрам
+                render_preview(time.perf_counter())
+            compose_scene()
+        # Обработка кликов на кнопку "Сброс"
+        elif button_reset_rect.collidepoint(x, y):
+            reset_simulation()
+        # Обработка кликов на кнопку "Движение"
+        elif button_dynamics_rect.collidepoint(x, y):
+            dynamics_running = not dynamics_running
+            mark_dirty()
+        elif y > CHARGES_TOP and mode != "focus":  # Игнорируем клики выше кнопок и в режиме фокусировки
+            index = charge_at(x, y)
+            if index is not None and event.button in (1, 3):
+                dragged_charge = index
+            elif event.button == 1:
+                add_charge(x, y, -1)
+            elif event.button == 3:
+                add_charge(x, y, 1)
+    elif event.type == pygame.MOUSEMOTION and dragged_charge is not None:
+        x, y = event.pos
+        # Заряд остается в окне ниже кнопок, где его можно снова схватить
+        move_charge(dragged_charge, min(max(x, 0), WIDTH), min(max(y, CHARGES_TOP), HEIGHT))
+    elif event.type == pygame.MOUSEBUTTONUP and dragged_charge is not None:
+        # Отпустили заряд - со следующего кадра слой достраивается в полном качестве,
+        # а движение он начинает с места
+        dynamics.stop_charge(dragged_charge)
+        dragged_charge = None
+    return True
 
 
 def main():
-    global draw_lines, mode, dropdown_active, selected_option, charges
+    global frame_time
+    compose_scene()
     running = True
     while running:
-        screen.fill(WHITE)
-
-        # Рисуем сохраненные линии, если нужно
-        if draw_lines:
-            if mode == "field" and field_lines_surface:
-                screen.blit(field_lines_surface, (0, 0))
-            elif mode == "equipotential" and equipotential_lines_surface:
-                screen.blit(equipotential_lines_surface, (0, 0))
-            elif mode == "focus":
-                # Для режима фокусировки перерисовываем каждый кадр
-                focus_lines_surface.fill((0, 0, 0, 0))
-                draw_focus_lines(focus_lines_surface)
-                screen.blit(focus_lines_surface, (0, 0))
-            elif mode == "potential_map" and potential_map_surface:
-                screen.blit(potential_map_surface, (0, 0))
-
-        # Рисуем заряды
-        draw_charges()
-
-        # Отображаем кнопки поверх всего
-        draw_buttons()
+        render_frame()
 
-        pygame.display.flip()
+        if is_animating():
+            # Во время анимации ограничиваем частоту кадров
+            frame_time = clock.tick(FPS) / 1000
+            events = pygame.event.get()
+        else:
+            # Когда ничего не меняется, спим до следующего события
+            events = [pygame.event.wait()] + pygame.event.get()
+            clock.tick()
+            frame_time = 0.0
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+        for event in events:
+            if not handle_event(event):
                 running = False
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                x, y = event.pos
-
-                # Обработка кликов на выпадающее меню
-                if dropdown_rect.collidepoint(x, y):
-                    dropdown_active = not dropdown_active
-                elif dropdown_active:
-                    for i, option in enumerate(dropdown_options):
-                        option_rect = pygame.Rect(WIDTH - 150, 40 + i * 30, 140, 30)
-                        if option_rect.collidepoint(x, y):
-                            selected_option = i
-                            dropdown_active = False
-                            if selected_option == 0:
-                                mode = "field"
-                            elif selected_option == 1:
-                                mode = "equipotential"
-                            elif selected_option == 2:
-                                mode = "focus"
-                            elif selected_option == 3:
-                                mode = "potential_map"
-                # Обработка кликов на кнопку "Построить"
-                elif button_build_rect.collidepoint(x, y):
-                    draw_lines = True
-                    if mode == "field":
-                        build_field_lines()
-                    elif mode == "equipotential":
-                        build_equipotential_lines()
-                    elif mode == "focus":
-                        build_focus_lines()
-                    elif mode == "potential_map":
-                        build_potential_map()
-                # Обработка кликов на кнопку "Сброс"
-                elif button_reset_rect.collidepoint(x, y):
-                    reset_simulation()
-                elif y > 130 and mode != "focus":  # Игнорируем клики выше кнопок и в режиме фокусировки
-                    if event.button == 1:
-                        charges.append((x, y, -1))
-                    elif event.button == 3:
-                        charges.append((x, y, 1))
+                break
 
     pygame.quit()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
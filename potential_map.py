@@ -1,4 +1,6 @@
 from cfg import *
+from power_lines import deposit_charges
+from mesh import mesh_convolve
 import numpy as np
 
 def compute_potential(x, y, scale=1.0):
@@ -11,52 +13,84 @@ def compute_potential(x, y, scale=1.0):
         total += q / (distance * scale)  # применяем масштаб к расстоянию
     return total
 
-def draw_potential_map(surface, radius_scale=1.0):
-    """Рисует цветовую карту потенциала на указанной поверхности с масштабированием радиуса."""
-    cell_size = 10
+def compute_potential_grid(xs, ys, scale=1.0):
+    """Вычисляет потенциал сразу во всех узлах сетки xs × ys."""
+    xs = np.asarray(xs, dtype=np.float32)
+    ys = np.asarray(ys, dtype=np.float32)
+    total = np.zeros((len(ys), len(xs)), dtype=np.float32)
+    distance = np.empty_like(total)
+    # Расстояние разделяется по осям, как в compute_field_grid
+    for cx, cy, q in zip(charges.x.astype(np.float32), charges.y.astype(np.float32), charges.q.astype(np.float32)):
+        np.add(((ys - cy) ** 2)[:, None], ((xs - cx) ** 2)[None, :], out=distance)
+        np.sqrt(distance, out=distance)
+        np.maximum(distance, 1, out=distance)  # избегаем деления на 0
+        total += np.float32(q / scale) / distance  # применяем масштаб к расстоянию
+    return total
 
-    grid_width = WIDTH // cell_size
-    grid_height = HEIGHT // cell_size
+def potential_kernel(ox, oy):
+    """Ядро свертки для потенциала на сетке, с тем же ограничением, что в compute_potential_grid."""
+    return 1 / np.maximum(np.sqrt(ox ** 2 + oy ** 2), 1)
 
-    min_potential = float('inf')
-    max_potential = -float('inf')
+def cell_potential_grid(width, height, cell_size, scale=1.0):
+    """Потенциал в центрах width × height ячеек; при многих зарядах - сверткой, как cell_field_grid."""
+    if len(charges) <= MESH_MIN_CHARGES:
+        xs = (np.arange(width) + 0.5) * cell_size
+        ys = (np.arange(height) + 0.5) * cell_size
+        return compute_potential_grid(xs, ys, scale)
+    potential, = mesh_convolve(deposit_charges(width, height, cell_size), cell_size, {"potential": potential_kernel})
+    return (potential / scale).astype(np.float32)
 
-    potentials = np.zeros((grid_height, grid_width))
+def map_grid_size(cell_size):
+    """Размер сетки карты. Округляем вверх: крайние ячейки обрезаются при выводе, но полос без цвета не остается."""
+    return -(-WIDTH // cell_size), -(-HEIGHT // cell_size)
 
-    for i in range(grid_height):
-        for j in range(grid_width):
-            x = j * cell_size + cell_size // 2
-            y = i * cell_size + cell_size // 2
-            potential = compute_potential(x, y, radius_scale)
-            potentials[i, j] = potential
-            if potential < min_potential:
-                min_potential = potential
-            if potential > max_potential:
-                max_potential = potential
+def draw_potential_cells(surface, potentials, cell_size):
+    """Раскрашивает посчитанные потенциалы ячеек и рисует поверх них заряды."""
+    grid_height, grid_width = potentials.shape
+    min_potential = potentials.min()
+    max_potential = potentials.max()
 
     # Нормализуем и рисуем
-    for i in range(grid_height):
-        for j in range(grid_width):
-            x = j * cell_size
-            y = i * cell_size
-            potential = potentials[i, j]
-
-            if max_potential != min_potential:
-                normalized = (potential - min_potential) / (max_potential - min_potential)
-            else:
-                normalized = 0.5
-
-            if normalized < 0.5:
-                blue_intensity = int(255 * (1 - 2 * normalized))
-                color = (0, 0, blue_intensity)
-            else:
-                red_intensity = int(255 * (2 * (normalized - 0.5)))
-                color = (red_intensity, 0, 0)
-
-            pygame.draw.rect(surface, color, (x, y, cell_size, cell_size))
+    if max_potential != min_potential:
+        normalized = (potentials - min_potential) / (max_potential - min_potential)
+    else:
+        normalized = np.full_like(potentials, 0.5)
+
+    colors = np.zeros((grid_width, grid_height, 3), dtype=np.uint8)
+    low = normalized.T < 0.5
+    colors[..., 2] = np.where(low, (255 * (1 - 2 * normalized.T)).astype(int), 0)
+    colors[..., 0] = np.where(low, 0, (255 * (2 * (normalized.T - 0.5))).astype(int))
+
+    cells = pygame.surfarray.make_surface(colors)
+    surface.blit(pygame.transform.scale(cells, (grid_width * cell_size, grid_height * cell_size)), (0, 0))
 
     # Рисуем заряды поверх карты
     for x, y, q in charges:
         color = RED if q > 0 else BLUE
         pygame.draw.circle(surface, color, (int(x), int(y)), 15)
 
+def draw_potential_map_preview(surface, scale, radius_scale=1.0):
+    """Быстрый предпросмотр карты потенциала: ячейки в scale раз крупнее обычных."""
+    cell_size = 10 * scale
+    grid_width, grid_height = map_grid_size(cell_size)
+    draw_potential_cells(surface, cell_potential_grid(grid_width, grid_height, cell_size, radius_scale), cell_size)
+
+def potential_map_steps(surface, radius_scale=1.0):
+    """Рисует цветовую карту потенциала на сетке 10 × 10 пикселей по шагам.
+
+    Генератор: потенциал считается полосами строк сетки, и после каждой
+    полосы управление возвращается вызывающему. Шаг занимает порядка
+    STEP_WORK элементарных операций.
+    """
+    cell_size = 10
+    grid_width, grid_height = map_grid_size(cell_size)
+    xs = (np.arange(grid_width) + 0.5) * cell_size
+    ys = (np.arange(grid_height) + 0.5) * cell_size
+    potentials = np.empty((grid_height, grid_width), dtype=np.float32)
+    # Потенциал стоит пропорционально числу зарядов
+    rows = max(1, STEP_WORK // (grid_width * max(len(charges), 1)))
+    for first in range(0, grid_height, rows):
+        band = slice(first, first + rows)
+        potentials[band] = compute_potential_grid(xs, ys[band], radius_scale)
+        yield
+    draw_potential_cells(surface, potentials, cell_size)
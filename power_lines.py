@@ -1,12 +1,14 @@
+import time
 import pygame
 import numpy as np
 from cfg import *
+from mesh import deposit, mesh_convolve
 
-def draw_charges():
-    """Рисует заряды на экране."""
+def draw_charges(surface=screen):
+    """Рисует заряды на указанной поверхности (по умолчанию на экране)."""
     for x, y, charge in charges:
         color = RED if charge > 0 else BLUE
-        pygame.draw.circle(screen, color, (x, y), 15)
+        pygame.draw.circle(surface, color, (x, y), CHARGE_RADIUS)
 
 def compute_field(x, y):
     """Вычисляет вектор поля в точке (x, y)."""
@@ -21,14 +23,189 @@ def compute_field(x, y):
         Ey += q * dy / r2
     return Ex, Ey
 
-def draw_field_lines(surface):
-    """Рисует плавные силовые линии на указанной поверхности."""
+def compute_field_grid(xs, ys):
+    """Вычисляет поле сразу во всех узлах сетки xs × ys (векторный аналог compute_field)."""
+    xs = np.asarray(xs, dtype=np.float32)
+    ys = np.asarray(ys, dtype=np.float32)
+    Ex = np.zeros((len(ys), len(xs)), dtype=np.float32)
+    Ey = np.zeros_like(Ex)
+    r2 = np.empty_like(Ex)
+    # r^2 = dx^2 + dy^2 разделяется по осям: разности считаются по строке и столбцу,
+    # а на всю сетку приходятся только сложение, деление и два умножения
+    for cx, cy, q in zip(charges.x.astype(np.float32), charges.y.astype(np.float32), charges.q.astype(np.float32)):
+        dx = xs - cx
+        dy = ys - cy
+        np.add((dy ** 2)[:, None], (dx ** 2)[None, :], out=r2)
+        np.maximum(r2, 10, out=r2)
+        np.divide(q, r2, out=r2)
+        Ex += r2 * dx[None, :]
+        Ey += r2 * dy[:, None]
+    return Ex, Ey
+
+def deposit_charges(width, height, cell_size):
+    """Раскладывает заряды по узлам сетки width × height с шагом cell_size (cloud-in-cell)."""
+    return deposit(charges.x, charges.y, charges.q, width, height, cell_size)
+
+# Ядра свертки для поля на сетке, с тем же ограничением на малых расстояниях, что в compute_field_grid
+def field_x_kernel(ox, oy):
+    return ox / np.maximum(ox ** 2 + oy ** 2, 10)
+
+def field_y_kernel(ox, oy):
+    return oy / np.maximum(ox ** 2 + oy ** 2, 10)
+
+def cell_field_grid(width, height, cell_size):
+    """Поле в центрах width × height ячеек cell_size × cell_size.
+
+    Точный расчет стоит пропорционально числу зарядов, поэтому при их
+    числе больше MESH_MIN_CHARGES заряды раскладываются по узлам и поле
+    получается сверткой (particle-mesh): время зависит только от размера
+    сетки, а погрешность - порядка размера ячейки, что для предпросмотра
+    незаметно.
+    """
+    if len(charges) <= MESH_MIN_CHARGES:
+        xs = (np.arange(width) + 0.5) * cell_size
+        ys = (np.arange(height) + 0.5) * cell_size
+        return compute_field_grid(xs, ys)
+    density = deposit_charges(width, height, cell_size)
+    Ex, Ey = mesh_convolve(density, cell_size, {"Ex": field_x_kernel, "Ey": field_y_kernel})
+    return Ex.astype(np.float32), Ey.astype(np.float32)
+
+def coarse_field_grid(cell_size):
+    """Поле в центрах ячеек cell_size × cell_size, покрывающих все окно."""
+    return cell_field_grid(-(-WIDTH // cell_size), -(-HEIGHT // cell_size), cell_size)
+
+def charge_cells(cell_size, shape):
+    """Маска ячеек грубой сетки, в которых лежат заряды."""
+    cells = np.zeros(shape, dtype=bool)
+    ix = (charges.x // cell_size).astype(np.int64)
+    iy = (charges.y // cell_size).astype(np.int64)
+    inside = (ix >= 0) & (ix < shape[1]) & (iy >= 0) & (iy < shape[0])
+    cells[iy[inside], ix[inside]] = True
+    return cells
+
+def trace_grid_lines(seeds, directions, Ux, Uy, cell_size, step, iterations, sinks=None, deadline=None):
+    """Трассирует все линии одновременно по полю направлений на грубой сетке.
+
+    Каждая затравка из seeds (n × 2) сдвигается на step за итерацию вдоль
+    направления из ячейки Ux, Uy, в которой лежит (directions = ±1 задает
+    сторону). Линия останавливается за краем окна, где поле исчезает, в
+    ячейке-стоке sinks, кроме той, откуда вышла. Возвращает точки
+    (итерации + 1) × n × 2 и число точек каждой линии.
+    """
+    grid_width = Ux.shape[1]
+    flat_x, flat_y = Ux.ravel(), Uy.ravel()
+
+    def cell_of(x, y):
+        return (y // cell_size).astype(np.int64) * grid_width + (x // cell_size).astype(np.int64)
+
+    n = len(seeds)
+    points = np.empty((iterations + 1, n, 2), dtype=np.float32)
+    points[0] = seeds
+    counts = np.ones(n, dtype=np.int64)
+
+    # Дальше держим только живые линии: index - их номера среди затравок
+    index = np.arange(n)
+    x = seeds[:, 0].astype(np.float32)
+    y = seeds[:, 1].astype(np.float32)
+    keep = (x >= 0) & (x < WIDTH) & (y >= 0) & (y < HEIGHT)
+    step = (step * np.asarray(directions)).astype(np.float32)
+    lines = [index, x, y, step]
+    lines = [values[keep] for values in lines]
+    cell = cell_of(lines[1], lines[2])
+    lines += [cell, cell]
+
+    for k in range(1, iterations + 1):
+        # Бюджет кадра исчерпан - все линии обрываются на одной длине
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        index, x, y, step, cell, start_cell = lines
+        ux, uy = flat_x[cell], flat_y[cell]
+        norm = np.hypot(ux, uy)
+        keep = norm >= 1e-3
+        np.maximum(norm, 1e-3, out=norm)
+        x += step * ux / norm
+        y += step * uy / norm
+        keep &= (x >= 0) & (x < WIDTH) & (y >= 0) & (y < HEIGHT)
+        if not keep.all():
+            lines = [values[keep] for values in lines]
+            index, x, y, step, cell, start_cell = lines
+        points[k, index, 0] = x
+        points[k, index, 1] = y
+        counts[index] += 1
+
+        cell = cell_of(x, y)
+        lines[4] = cell
+        if sinks is not None:
+            # Линия дошла до заряда: последняя точка уже в нем
+            keep = ~sinks.ravel()[cell] | (cell == start_cell)
+            if not keep.all():
+                lines = [values[keep] for values in lines]
+        if not len(lines[0]):
+            break
+    return points, counts
+
+def trace_deadline(deadline):
+    """Срок трассировки предпросмотра: половина оставшегося до deadline времени,
+    вторая половина остается на отрисовку линий."""
+    if deadline is None:
+        return None
+    now = time.perf_counter()
+    return now + max(deadline - now, 0) / 2
+
+def draw_grid_lines(surface, points, counts, deadline=None):
+    """Рисует линии, построенные trace_grid_lines.
+
+    После deadline линии больше не рисуются. Порядок линий перемешан
+    (одинаково от кадра к кадру), так что недорисованными остаются линии
+    по всему окну, а не у последних зарядов.
+    """
+    lines = np.flatnonzero(counts > 1)
+    for i in lines[np.random.default_rng(0).permutation(len(lines))].tolist():
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        pygame.draw.lines(surface, BLACK, False, points[:counts[i], i].tolist(), 1)
+
+def draw_field_lines_preview(surface, scale, deadline=None):
+    """Быстрый предпросмотр силовых линий при перетаскивании зарядов.
+
+    Поле считается один раз на сетке с шагом STEP * scale, затем линии от
+    всех зарядов продвигаются по ней одновременно: от положительных по полю,
+    от отрицательных против него.
+    """
+    if not charges:
+        return
+    cell_size = STEP * scale
+    Ex, Ey = coarse_field_grid(cell_size)
+    n_seeds = max(START_POINTS // scale, 4)
+    angles = np.linspace(0, 2 * np.pi, n_seeds, endpoint=False)
+    seeds = np.stack([
+        (charges.x[:, None] + 10 * np.cos(angles)).ravel(),
+        (charges.y[:, None] + 10 * np.sin(angles)).ravel(),
+    ], axis=1)
+    directions = np.repeat(np.where(charges.q > 0, 1, -1), n_seeds)
+    sinks = charge_cells(cell_size, Ex.shape)
+    points, counts = trace_grid_lines(seeds, directions, Ex, Ey, cell_size, cell_size,
+                                      ITERATIONS // scale, sinks, trace_deadline(deadline))
+    draw_grid_lines(surface, points, counts, deadline)
+
+def field_lines_steps(surface):
+    """Рисует силовые линии в режиме, заданном FIELD_LINE_SEEDING, по шагам:
+    генератор отдает управление после каждого шага трассировки, чтобы
+    построение можно было растянуть на несколько кадров."""
+    if FIELD_LINE_SEEDING == "even":
+        yield from even_field_lines_steps(surface)
+    else:
+        yield from radial_field_lines_steps(surface)
+
+def radial_field_lines_steps(surface):
+    """Рисует плавные силовые линии на указанной поверхности (по шагам)."""
     for cx, cy, q in charges:
         for angle in np.linspace(0, 2 * np.pi, START_POINTS):
             x, y = cx + 10 * np.cos(angle), cy + 10 * np.sin(angle)
             points = []
 
             for _ in range(ITERATIONS):
+                yield
                 Ex, Ey = compute_field(x, y)
                 norm = np.hypot(Ex, Ey)
                 if norm < 1e-3:
@@ -43,6 +220,133 @@ def draw_field_lines(surface):
             if len(points) > 1:
                 pygame.draw.lines(surface, BLACK, False, points, 1)
 
+class LineGrid:
+    """Пространственный хэш точек уже построенных силовых линий."""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def add_line(self, points):
+        for x, y in points:
+            self.cells.setdefault(self._cell(x, y), []).append((x, y))
+
+    def is_free(self, x, y, distance):
+        """Проверяет, что в радиусе distance от точки нет построенных линий."""
+        cx, cy = self._cell(x, y)
+        reach = int(np.ceil(distance / self.cell_size))
+        d2 = distance * distance
+        for i in range(cx - reach, cx + reach + 1):
+            for j in range(cy - reach, cy + reach + 1):
+                for px, py in self.cells.get((i, j), ()):
+                    if (px - x) ** 2 + (py - y) ** 2 < d2:
+                        return False
+        return True
+
+def nearest_charge(x, y, radius):
+    """Возвращает индекс заряда, ближе radius к точке, или None."""
+    r2 = radius * radius
+    for i, (cx, cy, q) in enumerate(charges):
+        if (x - cx) ** 2 + (y - cy) ** 2 < r2:
+            return i
+    return None
+
+def charge_bin(index, x, y, n_bins):
+    """Номер углового сектора заряда, через который проходит линия."""
+    cx, cy, q = charges[index]
+    angle = np.arctan2(y - cy, x - cx) % (2 * np.pi)
+    return int(round(angle / (2 * np.pi) * n_bins)) % n_bins
+
+def trace_half_line(x, y, direction, grid, d_test, free_radius, occupied_bins, n_bins):
+    """Трассирует линию от точки в одну сторону до сближения с другой линией.
+
+    Генератор: отдает управление после каждого шага, точки линии - его результат.
+    """
+    points = []
+    for _ in range(ITERATIONS):
+        yield
+        Ex, Ey = compute_field(x, y)
+        norm = np.hypot(Ex, Ey)
+        if norm < 1e-3:
+            break
+
+        x += direction * STEP * Ex / norm
+        y += direction * STEP * Ey / norm
+        if not (0 <= x <= WIDTH and 0 <= y <= HEIGHT):
+            break
+
+        hit = nearest_charge(x, y, 10)
+        if hit is not None:
+            # Линия дошла до заряда: занимаем его сектор, чтобы не строить ее второй раз
+            occupied_bins[hit].add(charge_bin(hit, x, y, n_bins))
+            points.append((x, y))
+            break
+
+        # Вблизи зарядов линии сходятся естественно, там проверку не делаем
+        if nearest_charge(x, y, free_radius) is None and not grid.is_free(x, y, d_test):
+            break
+
+        points.append((x, y))
+    return points
+
+def trace_line(x, y, grid, d_test, free_radius, occupied_bins, n_bins):
+    """Трассирует линию через точку в обе стороны (генератор, как trace_half_line)."""
+    backward = yield from trace_half_line(x, y, -1, grid, d_test, free_radius, occupied_bins, n_bins)
+    forward = yield from trace_half_line(x, y, 1, grid, d_test, free_radius, occupied_bins, n_bins)
+    return backward[::-1] + [(x, y)] + forward
+
+def even_field_lines_steps(surface):
+    """Рисует равномерно распределенные силовые линии (метод Jobard–Lefer, по шагам)."""
+    d_sep = LINE_SEPARATION
+    d_test = d_sep * LINE_TEST_RATIO
+    n_bins = START_POINTS
+    # Радиус, на котором соседние линии заряда расходятся на d_test
+    free_radius = n_bins * d_test / (2 * np.pi)
+
+    grid = LineGrid(d_sep)
+    occupied_bins = [set() for _ in charges]
+    lines = []
+
+    def add_line(points):
+        if len(points) > 1:
+            grid.add_line(points)
+            lines.append(points)
+            pygame.draw.lines(surface, BLACK, False, points, 1)
+
+    # Затравки вокруг зарядов, кроме секторов, куда уже пришли линии
+    for index, (cx, cy, q) in enumerate(charges):
+        for k, angle in enumerate(np.linspace(0, 2 * np.pi, n_bins, endpoint=False)):
+            if k in occupied_bins[index]:
+                continue
+            occupied_bins[index].add(k)
+            x, y = cx + 10 * np.cos(angle), cy + 10 * np.sin(angle)
+            add_line((yield from trace_line(x, y, grid, d_test, free_radius, occupied_bins, n_bins)))
+
+    # Новые затравки ставим в промежутки на расстоянии d_sep от построенных линий
+    queue = 0
+    while queue < len(lines):
+        line = lines[queue]
+        queue += 1
+        for (x1, y1), (x2, y2) in zip(line[::2], line[1::2]):
+            yield
+            dx, dy = x2 - x1, y2 - y1
+            length = np.hypot(dx, dy)
+            if length == 0:
+                continue
+            nx, ny = -dy / length, dx / length
+            for side in (-1, 1):
+                sx, sy = x1 + side * d_sep * nx, y1 + side * d_sep * ny
+                if not (0 <= sx <= WIDTH and 0 <= sy <= HEIGHT):
+                    continue
+                if nearest_charge(sx, sy, free_radius) is not None:
+                    continue
+                if not grid.is_free(sx, sy, d_sep * 0.99):
+                    continue
+                add_line((yield from trace_line(sx, sy, grid, d_test, free_radius, occupied_bins, n_bins)))
+
 def compute_potential(x, y):
     """Вычисляет электрический потенциал в точке (x,y)"""
     potential = 0.0
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Недописанные временные файлы старше этого возраста (с) считаются брошенными
+STALE_TMP_AGE = 60
+
+
+# Версия формата файлов и расчета траекторий. Увеличивать при любом изменении
+# физики в focus.py (field_E, electron_motion, константы, обрезка обратного
+# хода в simulate_electrons_trajectories), иначе с диска загрузятся старые траектории
+TRAJECTORY_CACHE_VERSION = 2
+
+
+def normalize_config(value):
+    """Приводит конфигурацию к виду, не зависящему от типов: все числа - float."""
+    if isinstance(value, dict):
+        return {str(k): normalize_config(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [normalize_config(v) for v in value]
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def trajectory_key(rings, electrons, t_max, n_steps):
+    """Хэш конфигурации симуляции: версия расчета, кольца, электроны, время и число шагов."""
+    config = normalize_config({'version': TRAJECTORY_CACHE_VERSION, 'rings': rings,
+                               'electrons': electrons, 't_max': t_max, 'n_steps': n_steps})
+    # repr чисел с плавающей точкой точен, поэтому одинаковые конфигурации дают один ключ
+    text = json.dumps(config, sort_keys=True, default=repr)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def entry_size(value):
+    t, trajectories = value
+    return t.nbytes + sum(trajectory.nbytes for trajectory in trajectories)
+
+
+class TrajectoryCache:
+    """Кэш результатов simulate_electrons_trajectories.
+
+    Недавние результаты держатся в памяти (LRU с пределом по байтам), все
+    результаты сохраняются сжатыми .npz в каталоге на диске. Когда каталог
+    превышает предел, удаляются файлы, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, directory, memory_limit, disk_limit):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._memory = OrderedDict()
+        self._memory_size = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """Возвращает (t, trajectories) или None, если конфигурация не считалась."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            # Обращение отмечаем и на диске, иначе самый используемый файл
+            # оказался бы самым старым и вытеснялся бы первым
+            self._touch(key)
+            return self._memory[key]
+
+        value = self._load(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+        try:
+            self._store(key, value)
+        except OSError:
+            # Диск недоступен - кэш в памяти продолжает работать
+            pass
+
+    def _remember(self, key, value):
+        if key in self._memory:
+            self._memory_size -= entry_size(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_size += entry_size(value)
+        # Последний результат держим всегда, даже если он один больше предела
+        while self._memory_size > self.memory_limit and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= entry_size(evicted)
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                t = data['t']
+                trajectories = [data[f'trajectory_{i}'] for i in range(int(data['count']))]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile, zlib.error):
+            # Поврежденный файл считаем промахом и пересчитываем
+            self._remove(path)
+            return None
+        self._touch(key)
+        return t, trajectories
+
+    def _touch(self, key):
+        """Отмечает обращение к файлу: диск вытесняется по времени изменения."""
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _store(self, key, value):
+        t, trajectories = value
+        arrays = {f'trajectory_{i}': trajectory for i, trajectory in enumerate(trajectories)}
+        os.makedirs(self.directory, exist_ok=True)
+        # Пишем во временный файл и переименовываем, чтобы не оставить недописанный
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, t=t, count=len(trajectories), **arrays)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith(".npz"):
+                entries.append((stat.st_mtime, stat.st_size, name))
+            elif name.endswith(".tmp") and now - stat.st_mtime > STALE_TMP_AGE:
+                # Остался от прерванной записи
+                self._remove(path)
+        total = sum(size for _, size, _ in entries)
+        # Самый свежий файл (только что записанный) не удаляем
+        for _, size, name in sorted(entries)[:-1]:
+            if total <= self.disk_limit:
+                break
+            self._remove(os.path.join(self.directory, name))
+            total -= size